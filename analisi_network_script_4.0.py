@@ -1,18 +1,36 @@
 import os
 import sys
 import csv
+import gzip
+import io
 import ipaddress
 import re
+import socket
+import struct
 import threading
 import datetime
 import time
 import queue
+import multiprocessing
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from operator import itemgetter
 import tkinter as tk
 from PIL import Image, ImageTk
 from tkinter import ttk, filedialog, messagebox, PhotoImage
 from typing import Iterable
 from tempfile import NamedTemporaryFile
 from pathlib import Path
+try:
+    from python_calamine import CalamineWorkbook  # lettura Excel veloce (parser Rust), opzionale
+except Exception:
+    CalamineWorkbook = None  # fallback su openpyxl
+try:
+    import ahocorasick  # pyahocorasick: filtro server su molti nomi in una sola scansione, opzionale
+except Exception:
+    ahocorasick = None  # fallback su confronti "in" per ogni server
 try:
     from openpyxl import load_workbook  # lettura Excel senza dipendere da pandas
 except Exception:
@@ -37,6 +55,43 @@ PORT_COMMENTS = {
     383: "Rule OMI",
 }
 
+# Same rules keyed by port string (as returned by ports_in) -> (priority, label)
+PORT_RULES = {str(port): (rank, label) for rank, (port, label) in enumerate(PORT_COMMENTS.items())}
+
+# === SCHEMA FINALE ORDINATO E RIDOTTO ===
+TARGET_COLS = [
+    "src_loc","src_name","src_addr","src_port","src_app","src_app_context","src_proc","src_service",
+    "dest_loc","dest_name","dest_addr","dest_port","dest_app","dest_app_context","dest_service",
+    "protocol_name","dest_proc","netstat_count","COMMENTO","first_seen","last_seen","critical"
+]
+
+# Rows handed to process_row_batch (and written) per call
+BATCH_SIZE = 8192
+
+# From this many server names on, the server filter uses an Aho-Corasick automaton (if installed)
+AHOCORASICK_MIN_SERVERS = 8
+
+# Read/write buffer for the CSV files (fewer, larger system calls)
+IO_BUFFER_SIZE = 1 << 20
+
+# Below this many CSV rows the worker-process startup costs more than it saves
+PARALLEL_MIN_ROWS = 200_000
+
+# How often the GUI drains the worker's message queue (ms)
+UI_POLL_MS = 100
+
+# Console scrollback: beyond this many lines the oldest ones are dropped (in blocks of 1/5)
+CONSOLE_MAX_LINES = 5000
+
+# Rendered preview images kept for reuse (one per window size)
+PREVIEW_CACHE_SIZE = 8
+
+# Preview re-render delay after the last <Configure> (ms): during a drag only the final size is rendered
+PREVIEW_DEBOUNCE_MS = 60
+
+# On close during a run: how long the run process gets to stop its batch workers before it is terminated (s)
+RUN_STOP_TIMEOUT_S = 2
+
 # Esempi
 """ Service-to-IP mapping
 SERVIZIO_TO_IPS = {
@@ -75,25 +130,60 @@ def build_ip_to_service_index(service_map: dict) -> dict:
     return index
 
 
-def build_subnet_index(subnets_by_location: dict) -> list:
+def build_subnet_index(subnets_by_location: dict) -> dict:
 
-    # Parse and sort subnets in  "subnet-to-location" mapping for efficient longest-prefix matching.
+    # Parse subnets once into integer ranges and bucket them by the /16 block(s) they cover,
+    # so a lookup only looks at the few subnets sharing the IP's /16.
+    # Inside each bucket, ranges are grouped by prefix length (most specific first); subnets with
+    # the same prefix length never partially overlap, so each group is a sorted, disjoint list
+    # searchable with bisect: {ip >> 16: [(starts, ends, locations), ...]}
     
-    compiled = []
+    by_prefix: dict[int, dict[int, tuple[int, str]]] = {}
     for location, cidrs in subnets_by_location.items():
+        # Normalize special location values once here, not on every matched row
+        normalized = LOC_NORMALIZATION.get(str(location).strip().lower(), location)
         for cidr in cidrs:
             try:
                 network = ipaddress.ip_network(str(cidr).strip(), strict=False)
-                compiled.append((network, location)) #una lista di tuple
             except ValueError:
                 continue  # Skip invalid CIDR notation
+            if network.version != 4:
+                continue  # Only IPv4 addresses are matched
+            start = int(network.network_address)
+            # first subnet listed wins for duplicated networks
+            by_prefix.setdefault(network.prefixlen, {}).setdefault(
+                start, (int(network.broadcast_address), normalized))
     
-    # Sort by prefix length (most specific first) for longest-prefix match
-    compiled.sort(key=lambda item: item[0].prefixlen, reverse=True)
-    return compiled
+    buckets: dict[int, list[tuple[list, list, list]]] = {}
+    for prefixlen in sorted(by_prefix, reverse=True):
+        touched = {}
+        for start, (end, location) in sorted(by_prefix[prefixlen].items()):
+            for top in range(start >> 16, (end >> 16) + 1):
+                group = touched.get(top)
+                if group is None:
+                    group = touched[top] = ([], [], [])
+                    buckets.setdefault(top, []).append(group)
+                group[0].append(start)
+                group[1].append(end)
+                group[2].append(location)
+    return buckets
+
+
+_unpack_ipv4 = struct.Struct(">I").unpack
+
+
+def parse_ipv4(ip_str: str) -> int | None:
 
+    # Parse a dotted-quad IPv4 string to int (None if invalid).
+    # socket.inet_pton is C code and as strict as ipaddress.IPv4Address (no "10.1", no leading zeros).
+
+    try:
+        return _unpack_ipv4(socket.inet_pton(socket.AF_INET, ip_str))[0]
+    except (OSError, ValueError):
+        return None
 
-def find_location_for_ip(ip_str: str, subnet_index: list) -> str | None:
+
+def find_location_for_ip(ip_str: str, subnet_index: dict) -> str | None:
 
     # Find location for an IP using longest-prefix match.
     
@@ -101,35 +191,128 @@ def find_location_for_ip(ip_str: str, subnet_index: list) -> str | None:
     if not ip_str:
         return None
     
-    try:
-        ip_obj = ipaddress.IPv4Address(ip_str)
-    except ValueError:
+    ip_int = parse_ipv4(ip_str)
+    if ip_int is None:
         return None
     
-    # Return first match (most specific subnet)
-    for network, location in subnet_index:
-        if ip_obj in network:
-            return location
+    # Probe the IP's /16 bucket from the longest prefix down: first match is the most specific subnet
+    for starts, ends, locations in subnet_index.get(ip_int >> 16, ()):
+        i = bisect_right(starts, ip_int) - 1
+        if i >= 0 and ip_int <= ends[i]:
+            return locations[i]
     
     return None
 
 
-def port_matches(target_port: int, port_value) -> bool:
+def estimate_csv_rows(csv_path: str, sample_size: int = 1 << 20) -> int:
+    """
+    Estimate the number of data rows in a CSV (header excluded) for the progress bar.
+    
+    Only the first `sample_size` bytes are read: the line count in the sample is
+    scaled by the file size. Files smaller than the sample are counted exactly.
+    
+    Args:
+        csv_path: Path to the CSV file
+        sample_size: Bytes to sample from the start of the file
+        
+    Returns:
+        Estimated number of rows after the header
+    """
+    size = os.path.getsize(csv_path)
+    with open(csv_path, "rb") as f:
+        sample = f.read(sample_size)
+    if not sample:
+        return 0
+    
+    lines = sample.count(b"\n")
+    if len(sample) >= size:
+        lines += not sample.endswith(b"\n")  # last line without newline
+    else:
+        lines = round(size * lines / len(sample))
+    return max(lines - 1, 0)  # minus header
+
+
+_NON_DIGITS = re.compile(r"\D+")
+
+
+def ports_in(port_value) -> frozenset:
     """
-    Check if target port number appears as a whole number in the port value.
+    Split a port value into the whole numbers it contains.
     
     Args:
-        target_port: Port number to search for
         port_value: Value from CSV (may contain multiple ports)
         
     Returns:
-        True if target port is found as a complete number
+        Set of the whole numbers found, as strings (e.g. "80,8080" -> {"80", "8080"})
     """
     port_str = str(port_value or "")
-    # Use word boundary regex to match whole numbers only
-    return bool(re.search(rf'(?<!\d){target_port}(?!\d)', port_str))
+    # Fast path: a single port number
+    if port_str.isdecimal():
+        return frozenset((port_str,))
+    return frozenset(token for token in _NON_DIGITS.split(port_str) if token)
+
+
+
+def read_excel_sheets(xlsx_path: str, sheet_names: Iterable[str]) -> dict:
+    """
+    Legge i fogli richiesti in un'unica passata e li restituisce come liste di righe
+    (la prima riga è l'intestazione).
+
+    Usa python-calamine se installato (un solo parse del foglio, senza oggetti cella),
+    altrimenti ripiega su openpyxl in modalità read-only.
+    Se un foglio non esiste, semplicemente non compare nel dizionario ritornato.
+    """
+    sheets: dict[str, list[tuple]] = {}
+
+    if CalamineWorkbook is not None:
+        wb = CalamineWorkbook.from_path(xlsx_path)
+        for name in sheet_names:
+            if name in wb.sheet_names:
+                rows = wb.get_sheet_by_name(name).to_python(skip_empty_area=False)
+                sheets[name] = [tuple(r) for r in rows]
+        return sheets
+
+    if load_workbook is None:
+        raise RuntimeError("Per leggere l'Excel serve 'openpyxl'. Installa con: pip install openpyxl")
+
+    wb = load_workbook(xlsx_path, read_only=True, data_only=True)
+    for name in sheet_names:
+        if name not in wb.sheetnames:
+            continue
+        ws = wb[name]
+        # Le dimensioni salvate nel file possono essere errate: le ignoro e leggo in streaming
+        # con iter_rows (niente accessi indicizzati .cell() né scansioni per max_row/max_column).
+        ws.reset_dimensions()
+        rows = list(ws.iter_rows(values_only=True))
+        width = max((len(r) for r in rows), default=0)
+        # le righe vuote in mezzo al foglio arrivano come [] invece che come tupla
+        sheets[name] = [tuple(r) + (None,) * (width - len(r)) for r in rows]
+    wb.close()
+    return sheets
 
 
+def _cell_text(value) -> str:
+
+    # Valore di cella come testo ripulito. calamine restituisce i numeri come float (123 -> 123.0):
+    # gli interi tornano "123" come con openpyxl, così il risultato non dipende dal backend.
+
+    if not value:
+        return ""  # None, celle vuote (e 0/False, come sempre)
+    if type(value) is float and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _column_indices(rows: list, sheet_name: str, needed: tuple) -> list[int]:
+
+    # Trovo gli indici (0-based) delle colonne richieste nell'intestazione (case-insensitive).
+
+    header = [str(h or "").strip().lower() for h in (rows[0] if rows else ())]
+    for col in needed:
+        if col not in header:
+            raise ValueError(f"Nel foglio '{sheet_name}' manca la colonna '{col}'.")
+    return [header.index(col) for col in needed]
+
 
 def load_mappings_from_excel(xlsx_path: str) -> tuple[dict, dict]:
     """
@@ -143,200 +326,404 @@ def load_mappings_from_excel(xlsx_path: str) -> tuple[dict, dict]:
     if not xlsx_path:
         return {}, {}
 
-    if load_workbook is None:
-        raise RuntimeError("Per leggere l'Excel serve 'openpyxl'. Installa con: pip install openpyxl")
-
-    wb = load_workbook(xlsx_path, read_only=True, data_only=True)
+    sheets = read_excel_sheets(xlsx_path, ("location", "servizi"))
 
     # --- Foglio location ---
-    if "location" not in wb.sheetnames:
+    if "location" not in sheets:
         raise ValueError("Nel file Excel manca il foglio 'location'.")
 
-    ws_loc = wb["location"]
-    # Trovo gli indici delle colonne (case-insensitive)
-    headers_loc = {str((ws_loc.cell(row=1, column=c).value or "")).strip().lower(): c
-                   for c in range(1, ws_loc.max_column + 1)}
-    for needed in ("location", "subnet"):
-        if needed not in headers_loc:
-            raise ValueError(f"Nel foglio 'location' manca la colonna '{needed}'.")
-
-    col_loc = headers_loc["location"]
-    col_sub = headers_loc["subnet"]
-
-    location_to_subnets: dict[str, list[str]] = {}
-    for r in range(2, ws_loc.max_row + 1):
-        loc = str(ws_loc.cell(row=r, column=col_loc).value or "").strip()
-        sub = str(ws_loc.cell(row=r, column=col_sub).value or "").strip()
+    rows_loc = sheets["location"]
+    col_loc, col_sub = _column_indices(rows_loc, "location", ("location", "subnet"))
+
+    # dict usati come insiemi ordinati: niente scansioni di lista per i duplicati
+    location_to_subnets: dict[str, dict[str, None]] = {}
+    for vals in rows_loc[1:]:
+        loc = _cell_text(vals[col_loc])
+        sub = _cell_text(vals[col_sub])
         if not loc or not sub:
             continue
+        subs = location_to_subnets.get(loc)
+        if subs is not None and sub in subs:
+            continue  # già presente (e già validata)
         # valida sintassi CIDR; se non valida, skip silenzioso
         try:
             ipaddress.ip_network(sub, strict=False)
         except Exception:
             continue
-        location_to_subnets.setdefault(loc, [])
-        if sub not in location_to_subnets[loc]:
-            location_to_subnets[loc].append(sub)
+        if subs is None:
+            subs = location_to_subnets[loc] = {}
+        subs[sub] = None
 
     # --- Foglio servizi ---
-    if "servizi" not in wb.sheetnames:
+    if "servizi" not in sheets:
         raise ValueError("Nel file Excel manca il foglio 'servizi'.")
 
-    ws_srv = wb["servizi"]
-    headers_srv = {str((ws_srv.cell(row=1, column=c).value or "")).strip().lower(): c
-                   for c in range(1, ws_srv.max_column + 1)}
-    for needed in ("servizio", "ip_address"):
-        if needed not in headers_srv:
-            raise ValueError(f"Nel foglio 'servizi' manca la colonna '{needed}'.")
-
-    col_srv = headers_srv["servizio"]
-    col_ip  = headers_srv["ip_address"]
+    rows_srv = sheets["servizi"]
+    col_srv, col_ip = _column_indices(rows_srv, "servizi", ("servizio", "ip_address"))
 
-    servizio_to_ips: dict[str, list[str]] = {}
-    for r in range(2, ws_srv.max_row + 1):
-        srv = str(ws_srv.cell(row=r, column=col_srv).value or "").strip()
-        ip  = str(ws_srv.cell(row=r, column=col_ip).value or "").strip()
+    servizio_to_ips: dict[str, dict[str, None]] = {}
+    for vals in rows_srv[1:]:
+        srv = _cell_text(vals[col_srv])
+        ip  = _cell_text(vals[col_ip])
         if not srv or not ip:
             continue
         # valida IP singolo
-        try:
-            ipaddress.IPv4Address(ip)
-        except Exception:
+        if parse_ipv4(ip) is None:
             continue
-        servizio_to_ips.setdefault(srv, [])
-        if ip not in servizio_to_ips[srv]:
-            servizio_to_ips[srv].append(ip)
+        servizio_to_ips.setdefault(srv, {})[ip] = None
 
-    return servizio_to_ips, location_to_subnets
+    return ({srv: list(ips) for srv, ips in servizio_to_ips.items()},
+            {loc: list(subs) for loc, subs in location_to_subnets.items()})
 
 
 # ========================================================================
 # ROW FILTERING FUNCTIONS
 # ========================================================================
 
-def should_include_row(row: dict, wave_filter: str, server_filter: list, 
-                       filter_columns: tuple, case_sensitive: bool) -> bool:
+def make_server_matcher(server_filter: list):
+    """
+    Build a function returning which servers of the filter appear in a (lowercased) name.
+    
+    Matching is case-insensitive substring search. With many server names and
+    pyahocorasick installed, all names are found in a single scan of the string
+    through an Aho-Corasick automaton instead of one substring search per server.
+    
+    Args:
+        server_filter: List of server names to filter for
+        
+    Returns:
+        match_servers(name_lower) -> tuple of the matching entries of server_filter
+        (in filter order, duplicates included)
+    """
+    pairs = tuple((srv, srv.lower()) for srv in server_filter or ())
+    needles = {needle for _, needle in pairs}
+    
+    if ahocorasick is None or len(needles) < AHOCORASICK_MIN_SERVERS:
+        def match_servers(name: str) -> tuple:
+            return tuple(srv for srv, needle in pairs if needle in name)
+        
+        return match_servers
+    
+    automaton = ahocorasick.Automaton()
+    for needle in needles:
+        automaton.add_word(needle, needle)
+    automaton.make_automaton()
+    
+    def match_servers(name: str) -> tuple:
+        found = {needle for _, needle in automaton.iter(name)}
+        if not found:
+            return ()
+        return tuple(srv for srv, needle in pairs if needle in found)
+    
+    return match_servers
+
+
+def make_row_classifier(wave_filter: str, server_filter: list, filter_indices: tuple,
+                        src_name_idx: int, dest_name_idx: int, case_sensitive: bool):
     """
-    Determine if a row should be included based on all filter criteria.
+    Build the row classifier for the given filter criteria.
+    
+    Everything that does not depend on the row (lowercased wave and server
+    needles, case handling) is computed here once, not on every row. The
+    servers matched by the filter are returned as well, so the caller can
+    update the outbound/inbound counters without scanning the names again.
     
     Args:
-        row: CSV row as dictionary
         wave_filter: Wave/group name to filter for
         server_filter: List of server names to filter for
-        filter_columns: Column names to check for wave filter
+        filter_indices: Column indices to check for wave filter
+        src_name_idx: Index of the 'src_name' column (None if not in the CSV)
+        dest_name_idx: Index of the 'dest_name' column (None if not in the CSV)
         case_sensitive: Whether wave filter is case-sensitive
         
     Returns:
-        True if row passes all filters, False otherwise
+        classify_row(row) -> None if the row is filtered out, otherwise
+        (servers matched in src_name, servers matched in dest_name)
     """
+    wave_needle = wave_filter if case_sensitive else (wave_filter or "").lower()
+    match_servers = make_server_matcher(server_filter) if server_filter else None
+    # Without name columns both names are blank: no server can match and nothing is self-talking
+    if src_name_idx is None or dest_name_idx is None:
+        if match_servers:
+            raise ValueError("Colonne 'src_name' o 'dest_name' non trovate nel CSV")
+        check_names = False
+    else:
+        check_names = True
+        names_of = itemgetter(src_name_idx, dest_name_idx)
+    no_hits = ((), ())
+    
     # Filter 1: Check wave/group membership
-    if wave_filter:
-        if case_sensitive:
-            wave_match = any(wave_filter in (row.get(col) or "") for col in filter_columns)
-        else:
-            wave_lower = wave_filter.lower()
-            wave_match = any(wave_lower in (row.get(col) or "").lower() for col in filter_columns)
+    # (itemgetter with a single index returns the bare value, not a 1-tuple)
+    if len(filter_indices) == 1:
+        def groups_of(row: list, i: int = filter_indices[0]) -> tuple:
+            return (row[i],)
+    else:
+        groups_of = itemgetter(*filter_indices)
+    if case_sensitive:
+        def in_wave(row: list) -> bool:
+            return any(wave_needle in group for group in groups_of(row))
+    else:
+        def in_wave(row: list) -> bool:
+            return any(wave_needle in group.lower() for group in groups_of(row))
+    
+    # The active filters do not change during a run: pick a classifier specialized for them,
+    # so the per-row code has no "is this filter on?" branches.
+    # Filter 2 = server name filter, Filter 3 = exclude self-talking (same source and destination).
+    if match_servers:
+        def classify_servers(row: list) -> tuple | None:
+            src_name, dest_name = names_of(row)
+            src_name = src_name.strip().lower()
+            dest_name = dest_name.strip().lower()
+            hits = (match_servers(src_name), match_servers(dest_name))
+            if not (hits[0] or hits[1]) or (src_name and src_name == dest_name):
+                return None
+            return hits
         
-        if not wave_match:
-            return False
+        if wave_needle:
+            def classify_row(row: list) -> tuple | None:
+                return classify_servers(row) if in_wave(row) else None
+        else:
+            classify_row = classify_servers
     
-    # Filter 2: Check server name filter (if specified)
-    if server_filter:
-        src_name = (row.get("src_name") or "").strip().lower()
-        dest_name = (row.get("dest_name") or "").strip().lower()
-        server_match = any(srv.lower() in src_name or srv.lower() in dest_name 
-                          for srv in server_filter)
-        if not server_match:
-            return False
+    elif check_names:
+        if wave_needle:
+            def classify_row(row: list) -> tuple | None:
+                if not in_wave(row):
+                    return None
+                src_name, dest_name = names_of(row)
+                src_name = src_name.strip().lower()
+                if src_name and src_name == dest_name.strip().lower():
+                    return None
+                return no_hits
+        else:
+            def classify_row(row: list) -> tuple | None:
+                src_name, dest_name = names_of(row)
+                src_name = src_name.strip().lower()
+                if src_name and src_name == dest_name.strip().lower():
+                    return None
+                return no_hits
     
-    # Filter 3: Exclude self-talking (same source and destination)
-    src_name = (row.get("src_name") or "").strip().lower()
-    dest_name = (row.get("dest_name") or "").strip().lower()
-    if src_name and dest_name and src_name == dest_name:
-        return False
+    else:
+        if wave_needle:
+            def classify_row(row: list) -> tuple | None:
+                return no_hits if in_wave(row) else None
+        else:
+            def classify_row(row: list) -> tuple | None:
+                return no_hits
     
-    return True
+    return classify_row
 
 
 # ========================================================================
 # ROW ENRICHMENT FUNCTIONS
 # ========================================================================
 
-def enrich_row_with_services(row: dict, ip_to_service: dict) -> None:
+_NOT_CACHED = object()  # sentinel: None is a valid cached result ("no location")
+
+def enrich_row_with_services(row: list, src_ip: str, dest_ip: str,
+                             src_service_idx: int, dest_service_idx: int, ip_to_service: dict) -> tuple[str, str]:
     """
     Add service information based on source and destination IPs.
     
     Args:
         row: CSV row to modify (modified in-place)
+        src_ip, dest_ip: Source and destination IPs of the row, already stripped
+        src_service_idx, dest_service_idx: Indices of the service columns to fill
         ip_to_service: Dictionary mapping IPs to service names
+        
+    Returns:
+        (source service, destination service), as written in the row
     """
-    src_ip = (row.get("src_addr") or "").strip()
-    dest_ip = (row.get("dest_addr") or "").strip()
-    
-    row["src_service"] = ip_to_service.get(src_ip, "unknown")
-    row["dest_service"] = ip_to_service.get(dest_ip, "unknown")
+    src_service = row[src_service_idx] = ip_to_service.get(src_ip, "unknown")
+    dest_service = row[dest_service_idx] = ip_to_service.get(dest_ip, "unknown")
+    return src_service, dest_service
 
 
-def enrich_row_with_locations(row: dict, subnet_index: list) -> None:
+def enrich_row_with_locations(row: list, src_ip: str, dest_ip: str,
+                              src_loc_idx: int, dest_loc_idx: int, subnet_index: dict,
+                              location_cache: dict) -> None:
     """
     Add location information based on source and destination IPs.
     
     Args:
         row: CSV row to modify (modified in-place)
-        subnet_index: Sorted list of (network, location) tuples
+        src_ip, dest_ip: Source and destination IPs of the row, already stripped
+        src_loc_idx, dest_loc_idx: Indices of the location columns to fill
+        subnet_index: /16 buckets built by build_subnet_index
+        location_cache: IP -> location (or None) results already computed, filled as we go
     """
-    src_ip = (row.get("src_addr") or "").strip()
-    dest_ip = (row.get("dest_addr") or "").strip()
-    
-    # Find locations via subnet matching
-    src_loc = find_location_for_ip(src_ip, subnet_index)
-    if src_loc is not None:
-        row["src_loc"] = src_loc
-    
-    dest_loc = find_location_for_ip(dest_ip, subnet_index)
-    if dest_loc is not None:
-        row["dest_loc"] = dest_loc
+    # Find locations via subnet matching (the same IPs repeat on many rows: look them up once)
+    location = location_cache.get(src_ip, _NOT_CACHED)
+    if location is _NOT_CACHED:
+        location = location_cache[src_ip] = find_location_for_ip(src_ip, subnet_index)
+    if location is not None:
+        row[src_loc_idx] = location  # already normalized by build_subnet_index
+    else:
+        normalize_location(row, src_loc_idx)
     
-    # Normalize special location values
-    for col in ("src_loc", "dest_loc"):
-        current = (row.get(col) or "").strip()
-        if current:
-            normalized = LOC_NORMALIZATION.get(current.lower())
-            if normalized is not None:
-                row[col] = normalized
+    location = location_cache.get(dest_ip, _NOT_CACHED)
+    if location is _NOT_CACHED:
+        location = location_cache[dest_ip] = find_location_for_ip(dest_ip, subnet_index)
+    if location is not None:
+        row[dest_loc_idx] = location
+    else:
+        normalize_location(row, dest_loc_idx)
+
+
+def normalize_location(row: list, col: int) -> None:
 
+    # Normalize special location values coming straight from the CSV (no subnet match).
 
-def enrich_row_with_comment(row: dict) -> None:
+    normalized = LOC_NORMALIZATION.get(row[col].strip().lower())
+    if normalized is not None:
+        row[col] = normalized
+
+
+def enrich_row_with_comment(row: list, src_service: str, dest_service: str,
+                            dest_port: str, commento_idx: int) -> None:
 
     # Add comment field based on service and port rules.
     
     comment = ""
     
     # Rule 1: Skip if either service is known (not unknown)
-    src_service = (row.get("src_service") or "").strip().lower()
-    dest_service = (row.get("dest_service") or "").strip().lower()
-    
-    if src_service != "unknown" or dest_service != "unknown":
+    if src_service.strip().lower() != "unknown" or dest_service.strip().lower() != "unknown":
         comment = "skip shared services"
     else:
-        # Rule 2: Check for specific ports
-        dest_port = row.get("dest_port")
-        for port, label in PORT_COMMENTS.items():
-            if port_matches(port, dest_port):
-                comment = label
-                break
+        # Rule 2: Check for specific ports (one dict probe per port in the value;
+        # if several rules match, the first one in PORT_COMMENTS wins)
+        best = None
+        for port in ports_in(dest_port):
+            rule = PORT_RULES.get(port)
+            if rule is not None and (best is None or rule < best):
+                best = rule
+        if best is not None:
+            comment = best[1]
     
     # Only set comment if we have something to say
     if comment:
-        row["COMMENTO"] = comment
+        row[commento_idx] = comment
+
+
+# ========================================================================
+# BATCH PROCESSING
+# ========================================================================
+
+def process_row_batch(rows: list, col: dict, n_fields: int, classify_row, server_filter: list,
+                      ip_to_service: dict, subnet_index: dict,
+                      location_cache: dict) -> tuple[list, dict, dict]:
+    """
+    Filter, enrich and project a batch of CSV rows onto TARGET_COLS.
+    
+    Column indices are resolved once per batch and the filter predicate once per
+    run, so the per-row loop only does list indexing and dict probes. Rows are
+    enriched in place: only rows that pass the filters get the blank output slots appended.
+    
+    Args:
+        rows: CSV rows as lists, as returned by csv.reader (modified in-place)
+        col: Column name -> index, including the columns appended for the output schema
+        n_fields: Number of columns in the CSV header
+        classify_row: Row classifier built by make_row_classifier
+        server_filter: List of server names to filter for
+        ip_to_service: Dictionary mapping IPs to service names
+        subnet_index: /16 buckets built by build_subnet_index
+        location_cache: IP -> location cache, reused across batches
+        
+    Returns:
+        (output rows ready for csv.writer, outbound count per server, inbound count per server)
+    """
+    SRC_ADDR, DEST_ADDR = col["src_addr"], col["dest_addr"]
+    SRC_SERVICE, DEST_SERVICE = col["src_service"], col["dest_service"]
+    SRC_LOC, DEST_LOC = col["src_loc"], col["dest_loc"]
+    DEST_PORT, COMMENTO = col["dest_port"], col["COMMENTO"]
+    to_output = itemgetter(*(col[c] for c in TARGET_COLS))
+    # Input fields needed by the enrichment, extracted in one C-level call per row
+    fields_of = itemgetter(SRC_ADDR, DEST_ADDR, DEST_PORT)
+    padding = [""] * n_fields
+    added_blank = [""] * (max(col.values()) + 1 - n_fields)
+    
+    outbound_count = dict.fromkeys(server_filter, 0)
+    inbound_count = dict.fromkeys(server_filter, 0)
+    
+    out_rows = []
+    append = out_rows.append
+    for row in rows:
+        # Campi mancanti vuoti, campi extra scartati
+        if len(row) != n_fields:
+            row = (row + padding)[:n_fields]
+        
+        # Check all filter criteria
+        hits = classify_row(row)
+        if hits is None:
+            continue
+        
+        # Slot vuoti per le colonne dello schema assenti nell'input (arricchimento compreso)
+        row.extend(added_blank)
+        
+        # aggiornamento contatori per ogni riga che passa il filtro
+        src_hits, dest_hits = hits
+        # Count outbound: server is source
+        for srv in src_hits:
+            outbound_count[srv] += 1
+        # Count inbound: server is destination
+        for srv in dest_hits:
+            inbound_count[srv] += 1
+        
+        # Enrich row with additional data (IPs stripped once, shared by services and locations)
+        src_ip, dest_ip, dest_port = fields_of(row)
+        src_ip = src_ip.strip()
+        dest_ip = dest_ip.strip()
+        src_service, dest_service = enrich_row_with_services(row, src_ip, dest_ip, SRC_SERVICE, DEST_SERVICE,
+                                                             ip_to_service)
+        enrich_row_with_locations(row, src_ip, dest_ip, SRC_LOC, DEST_LOC, subnet_index,
+                                  location_cache)
+        enrich_row_with_comment(row, src_service, dest_service, dest_port, COMMENTO)
+        
+        append(to_output(row))
+    
+    return out_rows, outbound_count, inbound_count
+
+
+# Per-process arguments for process_row_batch, set once by init_batch_worker
+_WORKER_ARGS: tuple = ()
+
+
+def init_batch_worker(col: dict, n_fields: int, classifier_args: tuple, server_filter: list, *tables) -> None:
+
+    # ProcessPoolExecutor initializer: receives the lookup tables once per worker, not per batch.
+    # The classifier is a closure (not picklable): each worker builds its own, once.
+
+    global _WORKER_ARGS
+    _WORKER_ARGS = (col, n_fields, make_row_classifier(*classifier_args), server_filter, *tables)
+
+
+def process_batch_in_worker(rows: list) -> tuple[list, dict, dict]:
+
+    # Entry point for worker processes (see init_batch_worker).
+
+    return process_row_batch(rows, *_WORKER_ARGS)
 
 
 # ========================================================================
 # MAIN PROCESSING LOGIC
 # ========================================================================
 
+def open_output_text(raw, compress: bool, name: str):
+
+    # Text layer for csv.writer over the binary output file.
+    # gzip level 1: the output is as large as the input, on slow disks writing it costs
+    # more than compressing it; higher levels gain little size for much more CPU.
+    # name goes in the gzip header (FNAME, used by gunzip -N and 7-Zip when extracting),
+    # instead of the temp file's name that gzip would take from raw.
+
+    if compress:
+        gz = gzip.GzipFile(filename=name, mode="wb", fileobj=raw, compresslevel=1)
+        return io.TextIOWrapper(gz, encoding="utf-8", newline="")
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+
 def run_user_python_code(selected_file: str, selected_excel: str, server_filter: list, wave_filter: str, 
-                         log_put, progress_set) -> None:
+                         log_put, progress_set, compress_output: bool = False) -> None:
     """
     Main processing function for network analysis.
     
@@ -348,6 +735,7 @@ def run_user_python_code(selected_file: str, selected_excel: str, server_filter:
         wave_filter: Wave/group name to filter for (optional)
         log_put: Function to output log messages
         progress_set: Function to update progress bar (0-100)
+        compress_output: Write the output gzip-compressed (.csv.gz) to cut the bytes written to disk
     """
     
     # Progress messages
@@ -367,24 +755,26 @@ def run_user_python_code(selected_file: str, selected_excel: str, server_filter:
     if not selected_excel:
         raise ValueError("Devi selezionare l'Excel con i fogli 'servizi' e 'location'.")
 
-    log_put(f"Carico mapping da Excel: {selected_excel}")
-    srv_map, loc_map = load_mappings_from_excel(selected_excel)
+    # Estimate total rows for progress tracking (without reading the whole file).
+    # La stima legge dal CSV e non dipende dall'Excel: gira in un thread mentre si caricano i mapping.
+    with ThreadPoolExecutor(max_workers=1) as io_pool:
+        rows_estimate = io_pool.submit(estimate_csv_rows, selected_file)
 
-    # Popola i global usando gli stessi nomi (niente fallback)
-    global SERVIZIO_TO_IPS, LOCATION_TO_SUBNETS
-    SERVIZIO_TO_IPS = srv_map
-    LOCATION_TO_SUBNETS = loc_map
+        log_put(f"Carico mapping da Excel: {selected_excel}")
+        srv_map, loc_map = load_mappings_from_excel(selected_excel)
 
-    log_put(f" - Servizi caricati: {len(SERVIZIO_TO_IPS)}")
-    log_put(f" - Location caricate: {len(LOCATION_TO_SUBNETS)}")
+        # Popola i global usando gli stessi nomi (niente fallback)
+        global SERVIZIO_TO_IPS, LOCATION_TO_SUBNETS
+        SERVIZIO_TO_IPS = srv_map
+        LOCATION_TO_SUBNETS = loc_map
 
-    # Count total rows for progress tracking
-    with open(selected_file, "r", newline="", encoding="utf-8") as f:
-        total_rows_raw = sum(1 for _ in f) - 1  # minus header
-    total_rows_raw = max(total_rows_raw, 0)
+        log_put(f" - Servizi caricati: {len(SERVIZIO_TO_IPS)}")
+        log_put(f" - Location caricate: {len(LOCATION_TO_SUBNETS)}")
+
+        total_rows_raw = rows_estimate.result()
     
     # Log initial info
-    log_put(f"Found {total_rows_raw:,} rows. Starting…")
+    log_put(f"Found ~{total_rows_raw:,} rows. Starting…")
     if server_filter:
         log_put(f"Filtering for servers: {', '.join(server_filter)}")
     if wave_filter:
@@ -398,10 +788,11 @@ def run_user_python_code(selected_file: str, selected_excel: str, server_filter:
     out_dir = Path(selected_file).parent
     base_name = "nutella"
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    final_path = out_dir / f"{base_name}_{timestamp}.csv"
+    final_path = out_dir / f"{base_name}_{timestamp}.csv{'.gz' if compress_output else ''}"
     
     # Processing state
-    processed = 0
+    scanned = 0    # righe lette dal CSV (guida la barra di avanzamento)
+    processed = 0  # righe che passano i filtri e vengono scritte
     next_step = 0
     last_ui_progress = 0.0
     last_ui_log = 0.0
@@ -415,105 +806,111 @@ def run_user_python_code(selected_file: str, selected_excel: str, server_filter:
     # SINGLE-PASS PROCESSING: Filter + Enrich + Write
     # ========================================================================
     
-    log_put("Conteggio righe da processare...")
-
     # Counters for server traffic direction
     outbound_count = {srv: 0 for srv in server_filter} if server_filter else {}
     inbound_count = {srv: 0 for srv in server_filter} if server_filter else {}
 
-    with open(selected_file, "r", newline="", encoding="utf-8") as src, \
-        NamedTemporaryFile("w", newline="", delete=False, encoding="utf-8", 
-                           dir=str(out_dir)) as tmp:
+    with open(selected_file, "r", newline="", encoding="utf-8", buffering=IO_BUFFER_SIZE) as src, \
+        NamedTemporaryFile("wb", delete=False, dir=str(out_dir), buffering=IO_BUFFER_SIZE) as tmp_raw, \
+        open_output_text(tmp_raw, compress_output, final_path.stem) as tmp:
         
-        reader = csv.DictReader(src)
+        reader = csv.reader(src)
+        header = next(reader, [])
+        col = {name: i for i, name in enumerate(header)}
 
         # Validate required columns exist
-        missing = [c for c in FILTER_COLUMNS if c not in reader.fieldnames]
+        missing = [c for c in FILTER_COLUMNS if c not in col]
         if missing:
             raise ValueError(f"Missing columns: {', '.join(missing)}")
         
-        if server_filter and ("src_name" not in reader.fieldnames or 
-                             "dest_name" not in reader.fieldnames):
+        if server_filter and ("src_name" not in col or "dest_name" not in col):
             raise ValueError("Colonne 'src_name' o 'dest_name' non trovate nel CSV")
         
-        # === SCHEMA FINALE ORDINATO E RIDOTTO ===
-        TARGET_COLS = [
-            "src_loc","src_name","src_addr","src_port","src_app","src_app_context","src_proc","src_service",
-            "dest_loc","dest_name","dest_addr","dest_port","dest_app","dest_app_context","dest_service",
-            "protocol_name","dest_proc","netstat_count","COMMENTO","first_seen","last_seen","critical"
-        ]
-
-        # NB: se alcune colonne non esistono nell'input, verranno scritte vuote.
+        # NB: se alcune colonne non esistono nell'input (comprese quelle di arricchimento),
+        # vengono aggiunte vuote in coda alle righe e quindi scritte vuote.
         # Scartiamo automaticamente eventuali campi extra presenti nelle righe.
-        writer = csv.DictWriter(tmp, fieldnames=TARGET_COLS, extrasaction="ignore")
-        writer.writeheader()
-        
-        # Process each row: filter -> enrich -> write
-                
-        # --- PASSATA 1: conteggio righe che passeranno il filtro ---
-        total_rows_to_process = 0
-        for row in reader:
-            if should_include_row(row, wave_filter, server_filter, FILTER_COLUMNS, CASE_SENSITIVE):
-                total_rows_to_process += 1
-
-        log_put(f"Righe da processare: {total_rows_to_process}")
-        src.seek(0)
-        reader = csv.DictReader(src)
+        n_fields = len(header)
+        added_cols = [c for c in TARGET_COLS if c not in col]
+        for i, name in enumerate(added_cols):
+            col[name] = n_fields + i
 
+        writer = csv.writer(tmp)
+        writer.writerow(TARGET_COLS)
 
-
-        for row in reader:
-            # Check all filter criteria
-            if not should_include_row(row, wave_filter, server_filter, 
-                                     FILTER_COLUMNS, CASE_SENSITIVE):
-                continue
-            
-            # aggiornamento contatori per ogni riga che passa il filtro
-            if server_filter:
-                src_name = (row.get("src_name") or "").strip().lower()
-                dest_name = (row.get("dest_name") or "").strip().lower()
-                for srv in server_filter:
-                    srv_lower = srv.lower()
-                    # Count outbound: server is source
-                    if srv_lower in src_name:
-                        outbound_count[srv] += 1
-                    # Count inbound: server is destination
-                    if srv_lower in dest_name:
-                        inbound_count[srv] += 1
-
-            # Enrich row with additional data
-            enrich_row_with_services(row, ip_to_service)
-            enrich_row_with_locations(row, subnet_index)
-            enrich_row_with_comment(row)
-            
-            
-            # Normalizza i campi mancanti per lo schema finale
-            for k in TARGET_COLS:
-                if k not in row or row[k] is None:
-                    row[k] = ""
-            # Write enriched row
-            writer.writerow(row)
-            
-            # Update progress tracking
-            processed += 1
+        def update_progress(final=False):
+            # Avanzamento stimato sulle righe lette rispetto al totale del file (passata unica).
+            nonlocal next_step, last_ui_progress, last_ui_log
             now = time.time()
-            pct = int(processed * 100 / total_rows_to_process) if total_rows_to_process else 0
+            if final:
+                pct, total = 100, scanned
+            else:
+                pct = min(int(scanned * 100 / total_rows_raw), 100) if total_rows_raw else 0
+                total = max(total_rows_raw, scanned)
             
             # Show step messages at thresholds
-            if next_step < len(THRESHOLDS) and pct >= THRESHOLDS[next_step]:
+            while next_step < len(THRESHOLDS) and pct >= THRESHOLDS[next_step]:
                 log_put(STEPS[next_step])
                 next_step += 1
             
             # Throttle UI updates to avoid overhead
-            if now - last_ui_progress >= 1 or processed == total_rows_to_process:
+            if now - last_ui_progress >= 1 or final:
                 progress_set(pct)
                 last_ui_progress = now
             
-            if now - last_ui_log >= 2 or processed == total_rows_to_process:
-                log_put(f"Row {processed}/{total_rows_to_process}  ({pct}% done)")
+            if now - last_ui_log >= 2 or final:
+                log_put(f"Row {scanned}/{total}  ({pct}% done), {processed} written")
                 last_ui_log = now
         
-        tmp_path = tmp.name
+        def write_batch(n_read, result):
+            nonlocal scanned, processed
+            out_rows, batch_outbound, batch_inbound = result
+            writer.writerows(out_rows)
+            
+            # aggiornamento contatori per le righe che passano il filtro
+            for srv, n in batch_outbound.items():
+                outbound_count[srv] += n
+            for srv, n in batch_inbound.items():
+                inbound_count[srv] += n
+            
+            scanned += n_read
+            processed += len(out_rows)
+            update_progress()
+        
+        # Process rows in batches: filter -> enrich -> write
+        update_progress()
+        row_iter = (vals for vals in reader if vals)  # righe vuote saltate
+        batches = iter(lambda: list(islice(row_iter, BATCH_SIZE)), [])
+        # Filtro costruito una sola volta per esecuzione (automa Aho-Corasick compreso)
+        name_idx = [col[c] if col[c] < n_fields else None for c in ("src_name", "dest_name")]
+        classifier_args = (wave_filter, server_filter, tuple(col[c] for c in FILTER_COLUMNS),
+                           *name_idx, CASE_SENSITIVE)
+        tables = (ip_to_service, subnet_index, {})  # ogni worker riceve la sua cache
+        workers = os.cpu_count() or 1
+        
+        if workers > 1 and total_rows_raw >= PARALLEL_MIN_ROWS:
+            # Lettura e scrittura restano qui; filtro e arricchimento girano nei processi worker.
+            # Le batch in volo sono limitate, così il CSV non viene caricato tutto in memoria,
+            # e vengono scritte nell'ordine di lettura.
+            log_put(f"Elaborazione parallela su {workers} processi")
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker,
+                                     initargs=(col, n_fields, classifier_args, server_filter, *tables)) as executor:
+                pending = deque()
+                for batch in batches:
+                    pending.append((len(batch), executor.submit(process_batch_in_worker, batch)))
+                    if len(pending) >= 2 * workers:
+                        n_read, future = pending.popleft()
+                        write_batch(n_read, future.result())
+                while pending:
+                    n_read, future = pending.popleft()
+                    write_batch(n_read, future.result())
+        else:
+            classify_row = make_row_classifier(*classifier_args)
+            for batch in batches:
+                write_batch(len(batch), process_row_batch(batch, col, n_fields, classify_row, server_filter,
+                                                          *tables))
+        
+        update_progress(final=True)
+        tmp_path = tmp_raw.name
     
     # Move temp file to final destination
     progress_set(100)
@@ -531,6 +928,54 @@ def run_user_python_code(selected_file: str, selected_excel: str, server_filter:
             log_put(f"{srv}: outbound_count={out_v} | inbound_count={in_v}")
 
 
+# Queue to the GUI in the process that runs the analysis, set by init_run_process
+_UI_QUEUE = None
+
+
+def init_run_process(ui_queue, stop_event) -> None:
+
+    # ProcessPoolExecutor initializer for the GUI's run process: receives the GUI message queue once,
+    # and starts the thread that stops the process when the GUI sets stop_event.
+
+    global _UI_QUEUE
+    _UI_QUEUE = ui_queue
+    threading.Thread(target=stop_run_process, args=(stop_event,), daemon=True).start()
+
+
+def stop_run_process(stop_event) -> None:
+
+    # The GUI closed mid-run: the batch pool workers are this process's children and would otherwise
+    # keep running until their current batch ends. An event rather than a signal handler, because
+    # on Windows terminate() is TerminateProcess and no handler would run.
+
+    stop_event.wait()
+    for proc in multiprocessing.active_children():
+        proc.terminate()
+    os._exit(1)
+
+
+def run_in_process(selected_file: str, selected_excel: str, server_filter: list, wave_filter: str,
+                   compress_output: bool) -> None:
+    """
+    Run the analysis in a separate process, reporting to the GUI through its queue.
+    
+    The whole run (CSV parsing included) happens outside the GUI process, so it
+    never competes with Tk for the GIL. All messages, "done" included, are put on
+    the same queue by this process, so the GUI receives them in order.
+    """
+    def queue_put(msg): _UI_QUEUE.put(("log", msg))
+    def progress_set(val): _UI_QUEUE.put(("progress", val))
+    try:
+        run_user_python_code(selected_file, selected_excel, server_filter, wave_filter, queue_put, progress_set,
+                             compress_output)
+        _UI_QUEUE.put(("status", "Completato"))
+    except Exception as e:
+        _UI_QUEUE.put(("log", f"[ERRORE] {e}"))
+        _UI_QUEUE.put(("status", "Fallito"))
+    finally:
+        _UI_QUEUE.put(("done", None))
+
+
 # ========================================================================
 # GUI COMPONENTS  —  “Ferrero / Nutella Edition”
 # ========================================================================
@@ -630,6 +1075,29 @@ def resource_path(relative_path):
         base_path = Path(__file__).resolve().parent
     return base_path / relative_path
 
+def load_background_image():
+
+    # Decode the preview background (None if missing or unreadable); App calls it off the Tk thread.
+
+    try:
+        base_dir = Path(__file__).resolve().parent
+    except Exception:
+        base_dir = Path.cwd()
+    bg_path = base_dir / "background.png"
+    if not bg_path.exists():
+        return None
+    try:
+        img = Image.open(bg_path)
+        # Alfa solo se serve davvero: un'immagine opaca in RGB è 3 byte/pixel invece di 4
+        # e il paste non deve comporre con la maschera
+        img = img.convert("RGBA") if "A" in img.getbands() or "transparency" in img.info else img.convert("RGB")
+        if img.mode == "RGBA" and img.getextrema()[3][0] == 255:
+            img = img.convert("RGB")
+        return img
+    except Exception as e:
+        print(f"Could not load image: {e}")
+        return None
+
 class App(tk.Tk):
     """Main application window — Ferrero / Nutella Edition."""
     def __init__(self):
@@ -654,12 +1122,21 @@ class App(tk.Tk):
         self.selected_excel = tk.StringVar(value="")
         self.server_filter = tk.StringVar(value="")
         self.wave_filter = tk.StringVar(value="Wave4")
+        self.compress_output = tk.BooleanVar(value=False)
         self.is_running = tk.BooleanVar(value=False)
-        self.ui_queue = queue.Queue()
+        self.ui_queue = multiprocessing.Queue()  # scritta dal processo di analisi (run_in_process)
+        self.stop_event = multiprocessing.Event()  # chiusura durante l'analisi (vedi stop_run_process)
+        self._executor = None  # processo di analisi, creato al primo "Esegui" e riusato
+
+        # Lo sfondo dell'anteprima si decodifica in un thread: non ritarda la prima apparizione della finestra
+        self._orig_bg_pil = None
+        self._bg_loader = threading.Thread(target=self._load_background, daemon=True)
+        self._bg_loader.start()
 
         self._setup_styles()
         self._create_widgets()
-        self.after(60, self._drain_queue)
+        self.after(UI_POLL_MS, self._drain_queue)
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
 
         # Set window/taskbar icon
         try:
@@ -668,6 +1145,9 @@ class App(tk.Tk):
         except Exception as e:
             print(f"Could not set icon: {e}")
 
+    def _load_background(self):
+        self._orig_bg_pil = load_background_image()
+
     def _setup_styles(self):
         s = ttk.Style()
         try:
@@ -691,6 +1171,8 @@ class App(tk.Tk):
         s.configure("Accent.TButton", background=self.COL_ACCENT, foreground="white")
         s.map("Accent.TButton",
               background=[("!disabled", self.COL_ACCENT), ("active", self.COL_ACCENT_HL)])
+        s.configure("Card.TCheckbutton", background=self.COL_CARD, foreground=self.COL_TEXT)
+        s.map("Card.TCheckbutton", background=[("active", self.COL_CARD)])
         s.configure("TProgressbar", troughcolor="#e8dfd5", background=self.COL_ACCENT)
 
     def _create_widgets(self):
@@ -768,6 +1250,8 @@ class App(tk.Tk):
         ttk.Entry(self.left, textvariable=self.wave_filter).pack(fill="x", pady=(0, 4))
         ttk.Label(self.left, text="Filtra server (es: SERVER1, SERVER2)", style="H2.TLabel").pack(anchor="w", pady=(12, 2))
         ttk.Entry(self.left, textvariable=self.server_filter).pack(fill="x")
+        ttk.Checkbutton(self.left, text="Comprimi output (.csv.gz)", variable=self.compress_output,
+                        style="Card.TCheckbutton").pack(anchor="w", pady=(12, 0))
 
         btns = ttk.Frame(self.left, style="Card.TFrame")
         btns.pack(fill="x", pady=16)
@@ -788,28 +1272,31 @@ class App(tk.Tk):
         self.image_container.configure(width=400, height=160)
         self.image_container.pack_propagate(False)
 
-        self._orig_bg_pil = None
         self._bg_photo = None
+        # Anteprime già renderizzate per dimensione (w, h): ridimensionare avanti e indietro non rifà il LANCZOS
+        self._preview_cache = OrderedDict()
+        self._preview_after_id = None
         self.image_label = tk.Label(self.image_container, bd=0,
                                     highlightthickness=0, bg=self.COL_SURF)
         self.image_label.pack(fill="both", expand=True)
 
-        try:
-            base_dir = Path(__file__).resolve().parent
-        except Exception:
-            base_dir = Path.cwd()
-        bg_path = base_dir / "background.png"
-        if bg_path.exists():
-            try:
-                self._orig_bg_pil = Image.open(bg_path).convert("RGBA")
-            except Exception as e:
-                print(f"Could not load image: {e}")
-
         def _render_preview(event=None):
+            self._preview_after_id = None
             w, h = self.image_container.winfo_width(), self.image_container.winfo_height()
             if w < 3 or h < 3:
                 return
-            canvas = Image.new("RGBA", (w, h), (245, 242, 239, 255))
+            if self._bg_loader.is_alive():
+                _schedule_preview()  # sfondo ancora in decodifica: si riprova tra poco
+                return
+            key = (w, h)
+            photo = self._preview_cache.get(key)
+            if photo is not None:
+                self._preview_cache.move_to_end(key)
+                if photo is not self._bg_photo:
+                    self._bg_photo = photo
+                    self.image_label.configure(image=photo)
+                return
+            canvas = Image.new("RGB", (w, h), (245, 242, 239))
             if self._orig_bg_pil:
                 src = self._orig_bg_pil
                 sw, sh = src.size
@@ -817,11 +1304,19 @@ class App(tk.Tk):
                 nw, nh = int(sw * ratio), int(sh * ratio)
                 resized = src.resize((nw, nh), Image.LANCZOS)
                 x, y = (w - nw) // 2, (h - nh) // 2
-                canvas.paste(resized, (x, y), resized)
-            self._bg_photo = ImageTk.PhotoImage(canvas)
+                canvas.paste(resized, (x, y), resized if resized.mode == "RGBA" else None)
+            self._bg_photo = self._preview_cache[key] = ImageTk.PhotoImage(canvas)
+            if len(self._preview_cache) > PREVIEW_CACHE_SIZE:
+                self._preview_cache.popitem(last=False)
             self.image_label.configure(image=self._bg_photo)
 
-        self.image_container.bind("<Configure>", _render_preview)
+        def _schedule_preview(event=None):
+            # <Configure> arriva a raffica durante il resize: si rimanda il render finché non si ferma
+            if self._preview_after_id is not None:
+                self.after_cancel(self._preview_after_id)
+            self._preview_after_id = self.after(PREVIEW_DEBOUNCE_MS, _render_preview)
+
+        self.image_container.bind("<Configure>", _schedule_preview)
         self.after(50, _render_preview)
 
     def _create_right_panel(self):
@@ -885,29 +1380,44 @@ class App(tk.Tk):
         server_filter = [s.strip() for s in server_text.split(",") if s.strip()] if server_text else []
         wave_filter = self.wave_filter.get().strip()
 
-        t = threading.Thread(
-            target=self._worker_wrapper,
-            args=(
-                self.selected_file.get(),
-                self.selected_excel.get(),
-                server_filter,
-                wave_filter,
-            ),
-            daemon=True,
+        # L'analisi gira in un processo separato: la GUI resta reattiva anche durante il parsing del CSV
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=1, initializer=init_run_process,
+                                                 initargs=(self.ui_queue, self.stop_event))
+        future = self._executor.submit(
+            run_in_process,
+            self.selected_file.get(),
+            self.selected_excel.get(),
+            server_filter,
+            wave_filter,
+            self.compress_output.get(),
         )
-        t.start()
+        future.add_done_callback(self._on_run_finished)
 
-    def _worker_wrapper(self, selected_file, selected_excel, server_filter, wave_filter):
-        def queue_put(msg): self.ui_queue.put(("log", msg))
-        def progress_set(val): self.ui_queue.put(("progress", val))
-        try:
-            run_user_python_code(selected_file, selected_excel, server_filter, wave_filter, queue_put, progress_set)
-            self.ui_queue.put(("status", "Completato"))
-        except Exception as e:
-            self.ui_queue.put(("log", f"[ERRORE] {e}"))
-            self.ui_queue.put(("status", "Fallito"))
-        finally:
-            self.ui_queue.put(("done", None))
+    def _on_run_finished(self, future):
+        # Chiamata dal thread dell'executor, non da Tk: tutto passa dalla coda, come per il processo.
+        # Di norma run_in_process ha già mandato "done"; qui resta solo il caso del processo
+        # morto a metà (BrokenProcessPool).
+        if future.cancelled() or future.exception() is None:
+            return
+        self.ui_queue.put(("broken", None))  # pool rotto: al prossimo "Esegui" se ne crea uno nuovo
+        self.ui_queue.put(("log", f"[ERRORE] {future.exception()}"))
+        self.ui_queue.put(("status", "Fallito"))
+        self.ui_queue.put(("done", None))
+
+    def _on_close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            if self.is_running.get():
+                # analisi in corso: il processo non deve tenere aperta l'app dopo la chiusura della finestra.
+                # Si ferma da solo insieme ai suoi worker; terminate() solo se non lo fa in tempo
+                # (su Windows ucciderebbe solo lui, lasciando orfani i worker)
+                self.stop_event.set()
+                for proc in multiprocessing.active_children():
+                    proc.join(RUN_STOP_TIMEOUT_S)
+                    if proc.is_alive():
+                        proc.terminate()
+        self.destroy()
 
 
     def _open_captcha(self):
@@ -927,25 +1437,47 @@ class App(tk.Tk):
         self.console.delete("1.0", "end")
 
     def _drain_queue(self):
+        # Tutti i messaggi in coda in un colpo solo: una sola insert nella console
+        # e solo l'ultimo valore di progress/status, invece di un aggiornamento Tk per messaggio.
+        logs = []
+        last_progress = last_status = None
+        done = broken = False
         try:
             while True:
                 key, payload = self.ui_queue.get_nowait()
                 if key == "log":
-                    self._log(payload)
+                    logs.append(payload)
                 elif key == "progress":
-                    self.progress["value"] = payload
+                    last_progress = payload
                 elif key == "status":
-                    self._set_status(payload)
+                    last_status = payload
                 elif key == "done":
-                    self.is_running.set(False)
-                    self.run_btn.state(["!disabled"])
+                    done = True
+                elif key == "broken":
+                    broken = True
         except queue.Empty:
             pass
         finally:
-            self.after(60, self._drain_queue)
+            if logs:
+                self._log("\n".join(logs))
+            if last_progress is not None:
+                self.progress["value"] = last_progress
+            if last_status is not None:
+                self._set_status(last_status)
+            if broken:
+                self._executor = None
+            if done:
+                self.is_running.set(False)
+                self.run_btn.state(["!disabled"])
+            self.after(UI_POLL_MS, self._drain_queue)
 
     def _log(self, msg):
         self.console.insert("end", msg + "\n")
+        # Scrollback limitato: il widget Text rallenta a ogni insert man mano che cresce
+        lines = int(self.console.index("end-1c").split(".")[0]) - 1
+        if lines > CONSOLE_MAX_LINES:
+            keep = CONSOLE_MAX_LINES - CONSOLE_MAX_LINES // 5
+            self.console.delete("1.0", f"{lines - keep + 1}.0")
         self.console.see("end")
 
     def _set_status(self, text):
@@ -953,5 +1485,6 @@ class App(tk.Tk):
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # necessario per i worker nell'eseguibile PyInstaller
     app = App()
     app.mainloop()
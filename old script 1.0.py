@@ -1,6 +1,15 @@
 import csv
 import os
+import re
+import socket
+import struct
 import ipaddress
+from array import array
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from multiprocessing import shared_memory
 from typing import Iterable
 from tempfile import NamedTemporaryFile
 
@@ -8,33 +17,16 @@ in_path = "detailed_application_dependency_data.csv"
 cols = ("src_group", "dest_group")
 needle = "Wave4"
 case_sensitive = True  # set to False for case-insensitive match
+IO_BUFFER_SIZE = 1 << 20  # big read/write buffers: fewer syscalls on large CSVs
+CHUNK_SIZE = 20_000  # rows per task sent to the worker processes
+PARALLEL_MIN_BYTES = 32 << 20  # below this the process pool startup costs more than it saves
 
-tmp = NamedTemporaryFile("w", newline="", delete=False, encoding="utf-8")
-
-with open(in_path, newline="", encoding="utf-8") as src, tmp as dst:
-    reader = csv.DictReader(src)
-
-    # Ensure required columns exist
-    missing = [c for c in cols if c not in reader.fieldnames]
-    if missing:
-        raise ValueError(f"Missing columns: {', '.join(missing)}")
-
-    writer = csv.DictWriter(dst, fieldnames=reader.fieldnames)
-    writer.writeheader()
-
-    if case_sensitive:
-        def match(row):
-            return any(needle in (row[c] or "") for c in cols)
-    else:
-        low_needle = needle.lower()
-        def match(row):
-            return any(low_needle in (row[c] or "").lower() for c in cols)
-
-    for row in reader:
-        if match(row):
-            writer.writerow(row)
-
-os.replace(tmp.name, in_path)
+def fit_row(row: list[str], n_fields: int) -> list[str]:
+    # Missing fields written empty, as DictReader/DictWriter did. Extra fields are now dropped
+    # (DictWriter used to raise ValueError on them).
+    if len(row) != n_fields:
+        row = (row + [""] * n_fields)[:n_fields]
+    return row
 
 # If your data is {service -> {IPs}} but your query is “given an IP, what’s the service?”, you’d have to scan all services ⇒ O(S) checks per lookup.
 # Inverting to {ip -> service} makes the query O(1).
@@ -63,20 +55,26 @@ PORT_COMMENTS = {
     383: "Rule OMI",
 }
 
-def port_matches(target: int, value) -> bool:
-    #Return True if `value` (string like '25', '80,8080', '10000-10100') contains `target`.
-    #Matches whole numbers (no false match for 125 when target is 25).
-   
-    s = str(value or "")
-    # whole-number match
-    if re.search(rf'(?<!\d){target}(?!\d)', s):
-        return True
-    # range match a-b
-    for a, b in re.findall(r'(\d+)\s*-\s*(\d+)', s):
-        lo, hi = int(a), int(b)
-        if lo <= target <= hi:
-            return True
-    return False
+# One pattern for both shapes, compiled once: a whole number, optionally followed by "-hi" (range a-b)
+_PORT_RE = re.compile(r'(?<!\d)(\d+)(?:\s*-\s*(\d+))?')
+_COMMENT_PORTS_BY_STR = {str(port): port for port in PORT_COMMENTS}
+
+def ports_of(value) -> frozenset[int]:
+    #Return the PORT_COMMENTS ports contained in `value` (string like '25', '80,8080', '10000-10100').
+    #Whole numbers match as written (no false match for 125 or 025 when the port is 25); a range a-b is
+    #intersected with the PORT_COMMENTS ports, never expanded, so '1-65535' costs 4 compares.
+    covered = set()
+    for a, b in _PORT_RE.findall(str(value or "")):
+        # whole-number match (range ends included)
+        for number in (a, b):
+            port = _COMMENT_PORTS_BY_STR.get(number)
+            if port is not None:
+                covered.add(port)
+        # range match a-b
+        if b:
+            lo, hi = int(a), int(b)
+            covered.update(port for port in PORT_COMMENTS if lo <= port <= hi)
+    return frozenset(covered)
 
 
 def build_ip_to_service(service_map: dict[str, set[str] | list[str]]) -> dict[str, str]:
@@ -87,16 +85,19 @@ def build_ip_to_service(service_map: dict[str, set[str] | list[str]]) -> dict[st
             index[str(ip).strip()] = service
     return index
 
-    # Convert {'cidr': 'location'} to a list of (IPv4Network, location),
+    # Convert {'location': [cidr, ...]} to sorted integer ranges grouped by prefix length,
     #Parse once, use many times. Converting strings → network objects is relatively expensive. Doing it up-front means later checks are fast and simple
     # sorted by descending prefix length (so longest-prefix match wins first).
 
 def rearrange_subnets(subnets_by_loc: dict[str, Iterable[str]]):
     #Parse once, use many times. Converting strings → network objects is relatively expensive. Doing it up-front means later checks are fast and simple
     #Input: {'LocationA': ['10.0.0.0/24', ...], 'LocationB': ['10.1.0.0/16', ...]}
-    #Output: [(IPv4Network('10.0.0.0/24'), 'LocationA'), (IPv4Network('10.1.0.0/16'), 'LocationB'), ...]
+    #Output: [(24, [start, ...], [end, ...], ['LocationA', ...]), (16, [...], [...], ['LocationB', ...]), ...]
+    # Networks become integer ranges grouped by prefix length. Networks with the same prefix length
+    # are either identical or disjoint, so each group is a sorted list of non-overlapping ranges
+    # that bisect can search in O(log N) instead of testing every network.
     
-    compiled = []
+    by_prefix: dict[int, dict[int, tuple[int, str]]] = {}
     for loc, cidrs in subnets_by_loc.items():
         for cidr in cidrs:
             try:
@@ -104,12 +105,23 @@ def rearrange_subnets(subnets_by_loc: dict[str, Iterable[str]]):
                 # strict=False lets you pass things like '10.0.0.1/24'
             except ValueError:
                 continue  # or raise, if you prefer not to silently skip bad CIDRs
+            if net.version != 4:
+                continue  # an IPv4 address is never inside an IPv6 network
 
-            compiled.append((net, loc))
+            # same network listed twice: the first one wins, as in the old linear scan
+            by_prefix.setdefault(net.prefixlen, {}).setdefault(
+                int(net.network_address), (int(net.broadcast_address), loc))
     # sorted by descending prefix length (so longest-prefix match wins first, /32 before /31 ... before /16.)
-    compiled.sort(key=lambda nl: nl[0].prefixlen, reverse=True)
+    compiled = []
+    for prefixlen in sorted(by_prefix, reverse=True):
+        starts = sorted(by_prefix[prefixlen])
+        ends = [by_prefix[prefixlen][start][0] for start in starts]
+        locs = [by_prefix[prefixlen][start][1] for start in starts]
+        compiled.append((prefixlen, starts, ends, locs))
     return compiled
-def find_location(ip_str: str, rearranged_nets: list[tuple[ipaddress.IPv4Network, str]]) -> str | None:
+_unpack_ipv4 = struct.Struct("!I").unpack  # 4 network-order bytes -> (int,)
+
+def find_location(ip_str: str, rearranged_nets: list[tuple[int, list[int], list[int], list[str]]]) -> str | None:
     #Return the location for the first (most specific) subnet that contains ip_str, else None.
     ip_str = (ip_str or "").strip()
     if not ip_str:
@@ -118,17 +130,35 @@ def find_location(ip_str: str, rearranged_nets: list[tuple[ipaddress.IPv4Network
         # return None, We signal “no result / don’t set anything” to the caller.
         return None
     try:
-        ip = ipaddress.IPv4Address(ip_str)
-    except ValueError:
+        # inet_pton is one C call (no IPv4Address object per lookup) and just as strict: no '10.1', no leading zeros
+        ip = _unpack_ipv4(socket.inet_pton(socket.AF_INET, ip_str))[0]
+    except (OSError, ValueError):
         return None  # invalid/not IPv4 → no change
-    for net, loc in rearranged_nets:
-        if ip in net:
-            return loc
+    for _prefixlen, starts, ends, locs in rearranged_nets:
+        # last network starting at or before ip: the only one of this length that can contain it
+        i = bisect_right(starts, ip) - 1
+        if i >= 0 and ip <= ends[i]:
+            return locs[i]
     return None
 
+def port_comment(value) -> str:
+    # Label of the first PORT_COMMENTS port contained in a dest_port value ("" if none).
+    # Called once per distinct dest_port (see comment_cache): one parse, then set membership per port.
+    covered = ports_of(value)
+    for port, label in PORT_COMMENTS.items():
+        if port in covered:
+            return label
+    return ""
+
 ip_index = build_ip_to_service(servizio_to_ips)
 
-nets = rearrange_subnets(subnets)
+# Service values the COMMENTO rule reads as "unknown" (stripped/lowercased, as always): computed once here,
+# so the row loop tests set membership instead of stripping and lowering both services on every row
+UNKNOWN_SERVICES = {"unknown"} | {s for s in ip_index.values() if s.strip().lower() == "unknown"}
+
+# Worker processes started with spawn (Windows) import this file as __mp_main__: they skip the
+# CIDR parsing and attach to the compiled ranges shared by the main process (see init_worker)
+nets = rearrange_subnets(subnets) if __name__ != "__mp_main__" else []
 
 # --- Normalizzazione dei valori per le location ---
 LOC_NORMALIZATION = {
@@ -136,71 +166,233 @@ LOC_NORMALIZATION = {
     "risc-unknown-private": "Private",
 }
 
+def normalize_location(value):
+    # Public/Private for the special Flexera values, anything else unchanged (None stays None).
+    current = (value or "").strip()
+    if current:
+        return LOC_NORMALIZATION.get(current.lower(), value)
+    return value
+
 # ------------------------------------------
 # 3) Transform CSV and write to new "target"
 # ------------------------------------------
 
-tmp = NamedTemporaryFile("w", newline="", delete=False, encoding="utf-8")
+# Flexera dumps repeat the same IPs and dest_port values on many rows:
+# subnet matching and port parsing are done once per distinct value, then reused.
+# The cached locations are already normalized, so a matched IP costs a single dict probe.
+# (one pair of caches per process)
+location_cache: dict[str, str | None] = {}
+comment_cache: dict[str, str] = {}
+_MISSING = object()  # cache miss marker (None is a valid cached location)
+
+def transform_rows(rows, added_blank, SRC_ADDR, DEST_ADDR, DEST_PORT,
+                   SRC_SERVICE, DEST_SERVICE, SRC_LOC, DEST_LOC, COMMENTO) -> list[list[str]]:
+    # Add service, location and COMMENTO to a chunk of rows (already fitted to the header);
+    # the column indices come from the header.
+    # Hot loop: bound methods and globals as locals (one fast local load instead of attribute/global lookups)
+    service_of = ip_index.get
+    cached_location = location_cache.get
+    cached_comment = comment_cache.get
+    unknown_services = UNKNOWN_SERVICES
+    out = []
+    append = out.append
+    for row in rows:
+        row.extend(added_blank)  # slots for the columns added to the header
 
-with open(in_path, newline="", encoding="utf-8") as src, tmp as dst:
-    reader = csv.DictReader(src)
-
-    # Ensure required columns exist (src_addr/dest_addr may or may not be present;
-    # if missing we’ll just write "unknown")
-    # list(...) ensures we have a mutable list to modify (append to)
-    fieldnames = list(reader.fieldnames or [])
-    for col in ("src_service", "dest_service", "src_loc", "dest_loc", "COMMENTO"):
-        if col not in fieldnames:
-            fieldnames.append(col)
-
-    writer = csv.DictWriter(dst, fieldnames=fieldnames)
-    writer.writeheader()
-
-    for row in reader:
         # --- Service by exact IP ---
-        src_ip = (row.get("src_addr") or "").strip()
-        dest_ip = (row.get("dest_addr") or "").strip()
+        src_ip = row[SRC_ADDR].strip() if SRC_ADDR is not None else ""
+        dest_ip = row[DEST_ADDR].strip() if DEST_ADDR is not None else ""
         # For services, we always set (unknown if no match)
-        row["src_service"] = ip_index.get(src_ip, "unknown")
-        row["dest_service"] = ip_index.get(dest_ip, "unknown")
+        src_service = row[SRC_SERVICE] = service_of(src_ip, "unknown")
+        dest_service = row[DEST_SERVICE] = service_of(dest_ip, "unknown")
 
         # --- Location by subnet (only set if we find a match) ---
-        src_loc = find_location(src_ip, nets)
+        # --- Public and Private IPs: normalized in the cache, or on the Flexera value if no match ---
+        src_loc = cached_location(src_ip, _MISSING)
+        if src_loc is _MISSING:
+            src_loc = location_cache[src_ip] = normalize_location(find_location(src_ip, nets))
         if src_loc is not None:
-            row["src_loc"] = src_loc  # set only on success
+            row[SRC_LOC] = src_loc  # set only on success
+        else:
+            row[SRC_LOC] = normalize_location(row[SRC_LOC])
 
-        dest_loc = find_location(dest_ip, nets)
+        dest_loc = cached_location(dest_ip, _MISSING)
+        if dest_loc is _MISSING:
+            dest_loc = location_cache[dest_ip] = normalize_location(find_location(dest_ip, nets))
         if dest_loc is not None:
-            row["dest_loc"] = dest_loc  # set only on success
-
-        # --- Public and Private IPs ---
-        for col in ("src_loc", "dest_loc"):
-            current = (row.get(col) or "").strip()
-            if current:
-                mapped = LOC_NORMALIZATION.get(current.lower())
-                if mapped is not None:
-                    row[col] = mapped
+            row[DEST_LOC] = dest_loc  # set only on success
+        else:
+            row[DEST_LOC] = normalize_location(row[DEST_LOC])
 
         # --- COMMENTO logic ---
-        comment = ""
-
         # Precedence: if at least one service is known, we skip due to shared services
-        if (row.get("src_service") or "").strip().lower() != "unknown" or \
-        (row.get("dest_service") or "").strip().lower() != "unknown":
-            comment = "skip shared services"
+        if src_service not in unknown_services or dest_service not in unknown_services:
+            row[COMMENTO] = "skip shared services"
         else:
-            dp = row.get("dest_port")
-            for port, label in PORT_COMMENTS.items():
-                if port_matches(port, dp):
-                    comment = label
-                    break
-
-        # Write only if we have something to say
-        if comment:
-            row["COMMENTO"] = comment
+            dp = row[DEST_PORT] if DEST_PORT is not None else ""
+            comment = cached_comment(dp)
+            if comment is None:
+                comment = comment_cache[dp] = port_comment(dp)
+            # Write only if we have something to say
+            if comment:
+                row[COMMENTO] = comment
+
+        append(row)
+    return out
+
+def share_nets(rearranged_nets):
+    # Packs the starts/ends of every prefix group in one shared memory block of uint32, so the
+    # worker processes read the same pages instead of each parsing the subnets again.
+    # Returns the block and its layout [(prefixlen, offset, count, locs)]; the caller closes and unlinks it.
+    packed = array("I")
+    layout = []
+    for prefixlen, starts, ends, locs in rearranged_nets:
+        layout.append((prefixlen, len(packed), len(starts), locs))
+        packed.extend(starts)
+        packed.extend(ends)
+    size = len(packed) * packed.itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(size, packed.itemsize))
+    shm.buf[:size] = packed.tobytes()
+    return shm, layout
+
+def attach_nets(name, layout):
+    # Same shape as rearrange_subnets, with memoryview slices of the shared block (bisect works on them as on lists)
+    shm = shared_memory.SharedMemory(name=name)
+    view = shm.buf.cast("I")
+    return shm, [(prefixlen, view[off:off + count], view[off + count:off + 2 * count], locs)
+                 for prefixlen, off, count, locs in layout]
+
+# Column layout for transform_rows in the worker processes, set once per process by init_worker.
+# ip_index is a module global: every worker has it from the import, nothing is pickled per chunk.
+_LAYOUT: tuple = ()
+_NETS_SHM = None  # kept referenced: the nets views point into its buffer
+
+def init_worker(nets_name, nets_layout, *layout):
+    global _LAYOUT, _NETS_SHM, nets
+    _NETS_SHM, nets = attach_nets(nets_name, nets_layout)
+    _LAYOUT = layout
+
+def transform_chunk(rows):
+    return transform_rows(rows, *_LAYOUT)
+
+# Bare "\r" inside a line (old Mac line endings): text mode would split there, so we do too
+_BARE_CR = re.compile(r"(?<=\r)(?!\n)")
+
+def decode_line(line):
+    text = line.decode("utf-8")
+    i = text.find("\r")
+    if i == -1 or (i == len(text) - 2 and text[-1] == "\n"):
+        return (text,)
+    return [part for part in _BARE_CR.split(text) if part]
+
+def needle_rows(raw, needle_bytes):
+    # csv.reader rows of raw (binary file), with a byte-level prefilter for the Wave filter: a record
+    # without needle_bytes cannot match src_group/dest_group, so it is dropped without being decoded or parsed.
+    # Only lines without any '"' are dropped, and only between records: csv cannot be inside a quoted
+    # field there, so such a line is exactly one record (a stray quote in an unquoted field is literal
+    # for csv, counting quotes would not say where records end). Everything else goes through
+    # csv.reader and match() as before. The header is always kept.
+    at_boundary = False
+
+    def feed():
+        nonlocal at_boundary
+        for line in raw:
+            if at_boundary and b'"' not in line and needle_bytes not in line:
+                continue
+            # a line with a bare "\r" is several lines for csv: each may continue a record
+            for part in decode_line(line):
+                at_boundary = False
+                yield part
+
+    # csv.reader pulls a line only when it needs one: after each row the next line starts a record
+    for row in csv.reader(feed()):
+        yield row
+        at_boundary = True
+
+def transform():
+    # Single pass: rows are filtered on the needle and transformed in the same loop, straight
+    # to target4.csv (no intermediate filtered copy of the input).
+    tmp = NamedTemporaryFile("w", newline="", delete=False, encoding="utf-8", buffering=IO_BUFFER_SIZE)
+
+    with open(in_path, "rb", buffering=IO_BUFFER_SIZE) as src, tmp as dst:
+        # Plain lists instead of one dict per row: columns are looked up by index, resolved once from the header.
+        # The byte-level prefilter (needle_rows) only works for a case-sensitive, non-empty needle;
+        # otherwise every line is decoded and parsed.
+        if case_sensitive and needle:
+            reader = needle_rows(src, needle.encode("utf-8"))
+        else:
+            reader = csv.reader(part for line in src for part in decode_line(line))
+        header = next(reader, [])
+        n_fields = len(header)
+
+        # 1) Wave filter: only rows whose src_group/dest_group contain the needle
+        missing = [c for c in cols if c not in header]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        col_idx = [header.index(c) for c in cols]
+
+        if case_sensitive:
+            def match(row):
+                return any(needle in row[i] for i in col_idx)
+        else:
+            low_needle = needle.lower()
+            def match(row):
+                return any(low_needle in row[i].lower() for i in col_idx)
+
+        # 2) Transform: service, location and COMMENTO columns
+
+        # Ensure required columns exist (src_addr/dest_addr may or may not be present;
+        # if missing we’ll just write "unknown")
+        # list(...) ensures we have a mutable list to modify (append to)
+        fieldnames = list(header)
+        for col in ("src_service", "dest_service", "src_loc", "dest_loc", "COMMENTO"):
+            if col not in fieldnames:
+                fieldnames.append(col)
+        added_blank = [""] * (len(fieldnames) - n_fields)
+
+        # Column indices, resolved once (first occurrence, like header.index); None = column not in the CSV
+        idx = {}
+        for i, name in enumerate(fieldnames):
+            idx.setdefault(name, i)
+        layout = (added_blank,
+                  idx.get("src_addr"), idx.get("dest_addr"), idx.get("dest_port"),
+                  idx["src_service"], idx["dest_service"], idx["src_loc"], idx["dest_loc"], idx["COMMENTO"])
+
+        writer = csv.writer(dst)
+        writer.writerow(fieldnames)
+
+        rows = (fit_row(row, n_fields) for row in reader if row)  # blank lines skipped
+        rows = (row for row in rows if match(row))
+        chunks = iter(lambda: list(islice(rows, CHUNK_SIZE)), [])
+        workers = os.cpu_count() or 1
+
+        if workers > 1 and os.path.getsize(in_path) >= PARALLEL_MIN_BYTES:
+            # The transform is pure-Python CPU work: chunks go to a process pool (the GIL does not
+            # matter there), while reading and writing stay here. At most 2 chunks per worker are
+            # in flight, and results are written back in input order.
+            # The subnet ranges go to the workers once, through shared memory.
+            nets_shm, nets_layout = share_nets(nets)
+            try:
+                with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                         initargs=(nets_shm.name, nets_layout, *layout)) as executor:
+                    pending = deque()
+                    for chunk in chunks:
+                        pending.append(executor.submit(transform_chunk, chunk))
+                        if len(pending) >= 2 * workers:
+                            writer.writerows(pending.popleft().result())
+                    while pending:
+                        writer.writerows(pending.popleft().result())
+            finally:
+                nets_shm.close()
+                nets_shm.unlink()
+        else:
+            for chunk in chunks:
+                writer.writerows(transform_rows(chunk, *layout))
 
-        writer.writerow(row)
+    out_path = "target4.csv"
+    os.replace(tmp.name, out_path)
 
 
-out_path = "target4.csv"
-os.replace(tmp.name, out_path)
\ No newline at end of file
+if __name__ == "__main__":
+    # the guard keeps worker processes (spawn on Windows) from running the transform again on import
+    transform()
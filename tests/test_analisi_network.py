@@ -0,0 +1,47 @@
+import importlib.util
+from pathlib import Path
+
+from openpyxl import Workbook
+
+# "analisi_network_script_4.0.py" is not an importable module name: load it from its path (the GUI is behind __main__)
+_spec = importlib.util.spec_from_file_location(
+    "analisi_network", Path(__file__).resolve().parent.parent / "analisi_network_script_4.0.py")
+analisi_network = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(analisi_network)
+
+
+def test_openpyxl_sheets_with_blank_and_gap_rows(tmp_path, monkeypatch):
+    # openpyxl fallback: a blank row inside the sheet comes back from iter_rows as [] instead of a tuple
+    monkeypatch.setattr(analisi_network, "CalamineWorkbook", None)
+    wb = Workbook()
+    loc = wb.active
+    loc.title = "location"
+    loc.append(["location", "subnet"])
+    loc.append([])
+    loc.append(["A", "10.0.0.0/8"])
+    loc["A5"] = "B"  # riga 4 mai scritta, riga 5 con la sola prima colonna
+    srv = wb.create_sheet("servizi")
+    srv.append(["servizio", "hostname", "ip_address"])
+    srv["A5"] = "Mail"
+    srv["C5"] = "10.1.1.1"
+    path = tmp_path / "mapping.xlsx"
+    wb.save(path)
+
+    sheets = analisi_network.read_excel_sheets(str(path), ("location", "servizi"))
+    assert all(type(r) is tuple and len(r) == 2 for r in sheets["location"])
+    assert all(type(r) is tuple and len(r) == 3 for r in sheets["servizi"])
+
+    servizio_to_ips, location_to_subnets = analisi_network.load_mappings_from_excel(str(path))
+    assert location_to_subnets == {"A": ["10.0.0.0/8"]}
+    assert servizio_to_ips == {"Mail": ["10.1.1.1"]}
+
+
+def test_gzip_output_records_final_name(tmp_path):
+    # the .csv.gz is written to a temp file: the gzip header must carry the final name, not the temp one
+    raw_path = tmp_path / "tmp1234"
+    with open(raw_path, "wb") as raw, analisi_network.open_output_text(raw, True, "nutella_x.csv") as text:
+        text.write("a,b\r\n")
+    data = raw_path.read_bytes()
+    assert data[3] & 0x08  # FLG.FNAME
+    assert data[10:data.index(b"\0", 10)] == b"nutella_x.csv"
+    assert analisi_network.gzip.decompress(data) == b"a,b\r\n"
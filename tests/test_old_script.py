@@ -0,0 +1,56 @@
+import csv
+import importlib.util
+import io
+from pathlib import Path
+
+# "old script 1.0.py" is not an importable module name: load it from its path (transform() is behind __main__)
+_spec = importlib.util.spec_from_file_location("old_script", Path(__file__).resolve().parent.parent / "old script 1.0.py")
+old_script = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(old_script)
+
+
+def wave_rows(data: bytes, needle: str):
+    # Header plus the rows containing needle, as the Wave filter sees them
+    rows = [row for row in old_script.needle_rows(io.BytesIO(data), needle.encode()) if row]
+    return rows[:1] + [row for row in rows[1:] if any(needle in field for field in row)]
+
+
+def text_rows(data: bytes, needle: str):
+    # Same selection through the plain text-mode csv.reader (no byte prefilter)
+    rows = [row for row in csv.reader(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", newline="")) if row]
+    return rows[:1] + [row for row in rows[1:] if any(needle in field for field in row)]
+
+
+def test_stray_quote_in_unquoted_field():
+    # csv reads a '"' inside an unquoted field as a literal: it must not open a multi-line record
+    data = (
+        b'src_proc,src_group\r\n'
+        b'cmd /c "run.bat,Wave3\r\n'
+        b'other,Wave4\r\n'
+        b'"multi\r\nline",Wave4\r\n'
+        b'ab"c,Wave4\r\n'
+        b'skipped,Wave3\r\n'
+    )
+    assert wave_rows(data, "Wave4") == text_rows(data, "Wave4") == [
+        ["src_proc", "src_group"],
+        ["other", "Wave4"],
+        ["multi\r\nline", "Wave4"],
+        ['ab"c', "Wave4"],
+    ]
+    # the stray quote and the one opening "p... must not cancel out: the multi-line record stays whole
+    data = b'h,g\nab"c,Wave3\n"p\nWave4",x\nlast,Wave4\n'
+    assert wave_rows(data, "Wave4") == text_rows(data, "Wave4") == [["h", "g"], ["p\nWave4", "x"], ["last", "Wave4"]]
+
+
+def test_quoted_multiline_record_kept_whole():
+    data = b'a,b\n"x\nWave4\ny",z\nq,r\n"Wave4",1\n'
+    assert wave_rows(data, "Wave4") == text_rows(data, "Wave4") == [["a", "b"], ["x\nWave4\ny", "z"], ["Wave4", "1"]]
+
+
+def test_header_kept_without_needle():
+    assert wave_rows(b"h1,h2\nx,y\n", "Wave4") == [["h1", "h2"]]
+
+
+def test_bare_cr_line_endings():
+    data = b'h1,h2\rx,Wave4\ry,Wave3\r"q\rr",Wave4'
+    assert wave_rows(data, "Wave4") == text_rows(data, "Wave4") == [["h1", "h2"], ["x", "Wave4"], ["q\rr", "Wave4"]]